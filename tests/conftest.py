@@ -1,5 +1,6 @@
 """General pytest fixtures"""
 
+import asyncio
 import os
 import shutil
 import subprocess
@@ -8,11 +9,27 @@ import time
 
 import pytest
 from _pytest.mark import Mark
+from tornado.httpclient import AsyncHTTPClient
 
 from jupyterhub_traefik_proxy import TraefikEtcdProxy
 from jupyterhub_traefik_proxy import TraefikConsulProxy
 from jupyterhub_traefik_proxy import TraefikTomlProxy
 
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Run the async tests on uvloop's faster event loop when available
+# (uvloop doesn't support Windows)
+if uvloop is not None and sys.platform != "win32":
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
 
 # Define a "slow" test marker so that we can run the slow tests at the end
 # ref: https://docs.pytest.org/en/6.0.1/example/simple.html#control-skipping-of-tests-according-to-command-line-option
@@ -37,6 +54,41 @@ def pytest_configure(config):
     config.addinivalue_line("markers", "slow: marks tests as slow.")
 
 
+# Max number of concurrent requests (and kept-alive connections)
+# of the curl http client shared by the tests
+HTTP_CLIENT_MAX_CLIENTS = 40
+
+
+@pytest.fixture(scope="session")
+def http_client_class():
+    """
+    Configure the AsyncHTTPClient implementation once per test session.
+    Use the curl based client when pycurl is available, since unlike
+    SimpleAsyncHTTPClient it keeps connections alive between requests.
+    """
+    if pycurl is not None:
+        AsyncHTTPClient.configure(
+            "tornado.curl_httpclient.CurlAsyncHTTPClient",
+            max_clients=HTTP_CLIENT_MAX_CLIENTS,
+        )
+    yield AsyncHTTPClient
+    AsyncHTTPClient.configure(None)
+
+
+@pytest.fixture
+async def http_client(http_client_class):
+    """
+    Fixture returning the AsyncHTTPClient shared by all the requests of a test.
+    AsyncHTTPClient instances are bound to an event loop, so a single instance
+    is created in the loop of each test.
+    """
+    client = http_client_class()
+    if pycurl is not None:
+        client._multi.setopt(pycurl.M_MAXCONNECTS, HTTP_CLIENT_MAX_CLIENTS)
+    yield client
+    client.close()
+
+
 @pytest.fixture
 async def no_auth_consul_proxy(consul_no_acl):
     """
@@ -1,49 +1,75 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+"""Dummy backends answering requests with the port they listen on"""
+
 import asyncio
+
+from tornado.httpserver import HTTPServer
+from tornado.web import Application, RequestHandler
 import websockets
 
 
-class DummyServer(BaseHTTPRequestHandler):
+class DummyHandler(RequestHandler):
+    def initialize(self, port):
+        self.port = port
+
     def _set_headers(self):
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.send_header("Host", self.headers["Host"])
-        self.send_header("Origin", self.headers["Origin"])
-        self.end_headers()
+        self.set_header("Content-type", "text/html")
+        # Echo the headers set by the proxy, so the tests can check them
+        for header in ("Host", "Origin"):
+            if header in self.request.headers:
+                self.set_header(header, self.request.headers[header])
 
-    def do_GET(self):
+    def head(self):
         self._set_headers()
-        self.wfile.write(bytes(str(self.server.server_port), "utf-8"))
 
+    def get(self):
+        self._set_headers()
+        self.write(str(self.port))
 
-async def send_port(websocket, path):
-    await websocket.send(str(websocket.port))
 
+def _skip_request_log(handler):
+    """The backends answer many requests per test, don't log each of them"""
 
-def run(port=80):
-    dummy_server = HTTPServer(("localhost", port), DummyServer)
 
-    try:
-        dummy_server.serve_forever()
-    except KeyboardInterrupt:
-        pass
+async def start_backend(port, proto="http"):
+    """Start a dummy backend on `port` in the running event loop.
+
+    Return a coroutine function stopping it.
+    """
+    if proto == "http":
+        app = Application(
+            [(r".*", DummyHandler, {"port": port})],
+            log_function=_skip_request_log,
+        )
+        server = HTTPServer(app)
+        server.listen(port, "localhost")
 
-    dummy_server.server_close()
+        async def stop():
+            server.stop()
+            await server.close_all_connections()
+
+    else:
+
+        async def send_port(websocket, path=None):
+            await websocket.send(str(port))
+
+        server = await websockets.serve(send_port, "localhost", port)
+
+        async def stop():
+            server.close()
+            await server.wait_closed()
+
+    return stop
 
 
 if __name__ == "__main__":
     from sys import argv
 
-    if len(argv) == 2:
-        run(port=int(argv[1]))
-    elif len(argv) == 3:
-        proto = str(argv[2])
-        if proto == "http":
-            run(port=int(argv[1]))
-        else:
-            asyncio.get_event_loop().run_until_complete(
-                websockets.serve(send_port, "localhost", int(argv[1]))
-            )
-            asyncio.get_event_loop().run_forever()
-    else:
-        run()
+    port = int(argv[1]) if len(argv) > 1 else 80
+    proto = str(argv[2]) if len(argv) > 2 else "http"
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start_backend(port, proto))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
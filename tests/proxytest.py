@@ -1,13 +1,13 @@
 """Tests for the base traefik proxy"""
 
-import copy
+import asyncio
+import dummy_http_server
 import utils
-import subprocess
-import sys
 
 from contextlib import contextmanager
-from os.path import dirname, join, abspath
-from random import randint
+from random import sample
+from threading import Thread
+from types import SimpleNamespace
 from unittest.mock import Mock
 from urllib.parse import quote
 from urllib.parse import urlparse
@@ -15,10 +15,14 @@ from urllib.parse import urlparse
 import pytest
 from jupyterhub.objects import Hub, Server
 from jupyterhub.user import User
-from jupyterhub.utils import exponential_backoff, url_path_join
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPClientError
+from jupyterhub.utils import url_path_join
+from tornado.httpclient import HTTPRequest, HTTPClientError
 import websockets
 
+# Unique ports handed out to the mock spawners, so that no two of them
+# share a server url during the test session
+_spawner_ports = iter(sample(range(10000, 60000), 1000))
+
 
 class MockApp:
     def __init__(self):
@@ -39,7 +43,7 @@ class MockSpawner:
         self.proxy_spec = url_path_join(self.user.proxy_spec, name, "/")
 
     def start(self):
-        self.server = Server.from_url("http://127.0.0.1:%i" % randint(1025, 65535))
+        self.server = Server.from_url("http://127.0.0.1:%i" % next(_spawner_ports))
 
     def stop(self):
         self.server = None
@@ -61,42 +65,66 @@ class MockSpawner:
         return self.ready
 
 
+# The db session shared by all the mock users
+_db = Mock()
+
+
 class MockUser(User):
     """Mock User for use in proxytest"""
 
     def __init__(self, name):
-        orm_user = Mock()
-        orm_user.name = name
-        orm_user.orm_spawners = ""
-        super().__init__(orm_user=orm_user, db=Mock())
+        orm_user = SimpleNamespace(name=name, orm_spawners="")
+        super().__init__(orm_user=orm_user, db=_db)
 
     def _new_spawner(self, spawner_name, **kwargs):
         return MockSpawner(spawner_name, user=self, **kwargs)
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def launch_backend():
-    dummy_server_path = abspath(join(dirname(__file__), "dummy_http_server.py"))
-    running_backends = []
+    """Launch dummy backends shared by the whole test session.
+
+    A backend already running on the requested port with the same
+    protocol is reused instead of being launched again.
+    """
+    # The backends are served in-process, from an event loop running
+    # in a background thread, since every test gets its own event loop
+    loop = asyncio.new_event_loop()
+    loop_thread = Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    # port: (proto, stop coroutine function)
+    running_backends = {}
+
+    def run_in_loop(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
 
     def _launch_backend(port, proto="http"):
-        backend = subprocess.Popen(
-            [sys.executable, dummy_server_path, str(port), proto], stdout=None
-        )
-        running_backends.append(backend)
+        if port in running_backends:
+            running_proto, stop = running_backends[port]
+            if running_proto == proto:
+                return
+            # free the port for a backend using the requested protocol
+            run_in_loop(stop())
+
+        stop = run_in_loop(dummy_http_server.start_backend(port, proto))
+        running_backends[port] = (proto, stop)
 
     yield _launch_backend
 
-    for proc in running_backends:
-        proc.kill()
-    for proc in running_backends:
-        proc.wait()
+    for _, stop in running_backends.values():
+        run_in_loop(stop())
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join()
+    loop.close()
 
 
-async def wait_for_services(urls):
+async def wait_for_services(urls, http_client):
     # Wait until traefik and the backend are ready
-    await exponential_backoff(
-        utils.check_services_ready, "Service not reacheable", urls=urls
+    await utils.poll_until(
+        utils.check_services_ready,
+        "Service not reacheable",
+        urls=urls,
+        http_client=http_client,
     )
 
 
@@ -146,38 +174,34 @@ async def wait_for_services(urls):
     ],
 )
 async def test_add_get_delete(
-    request, proxy, launch_backend, routespec, existing_routes, event_loop
+    request, proxy, launch_backend, http_client, routespec, existing_routes, event_loop
 ):
     default_target = "http://127.0.0.1:9000"
     data = {"test": "test1", "user": "username"}
 
     default_backend = urlparse(default_target)
-    extra_backends = []
 
     proxy_url = proxy.public_url.rstrip("/")
 
-    def normalize_spec(spec):
-        return proxy.validate_routespec(spec)
+    # just use existing Jupyterhub check instead of making own one.
+    # Validate each spec once, the specs expected to raise a ValueError map to None
+    normalized = {}
+    for spec in [routespec, *existing_routes]:
+        try:
+            normalized[spec] = proxy.validate_routespec(spec)
+        except ValueError:
+            normalized[spec] = None
 
     def expected_output(spec, url):
         return {
-            "routespec": normalize_spec(spec),
+            "routespec": normalized[spec],
             "target": url,
             "data": data,
         }
 
-    # just use existing Jupyterhub check instead of making own one
-    def expect_value_error(spec):
-        try:
-            normalize_spec(spec)
-        except ValueError:
-            return True
-
-        return False
-
     @contextmanager
     def context(spec):
-        if expect_value_error(spec):
+        if normalized[spec] is None:
             with pytest.raises(ValueError):
                 yield
         else:
@@ -187,54 +211,58 @@ async def test_add_get_delete(
         with context(spec):
             route = await proxy.get_route(spec)
 
-        if not expect_value_error(spec):
-            try:
-                del route["data"]["last_activity"]  # CHP
-            except KeyError:
-                pass
+        if normalized[spec] is not None:
+            route["data"].pop("last_activity", None)  # CHP
 
             assert route == expected_output(spec, backend.geturl())
 
             # Test the actual routing
-            responding_backend1 = await utils.get_responding_backend_port(
-                proxy_url, normalize_spec(spec)
-            )
-            responding_backend2 = await utils.get_responding_backend_port(
-                proxy_url, normalize_spec(spec) + "something"
+            responding_backend1, responding_backend2 = await asyncio.gather(
+                utils.get_responding_backend_port(
+                    proxy_url, normalized[spec], http_client
+                ),
+                utils.get_responding_backend_port(
+                    proxy_url, f"{normalized[spec]}something", http_client
+                ),
             )
             assert (
                 responding_backend1 == backend.port
                 and responding_backend2 == backend.port
             )
 
-    for i, spec in enumerate(existing_routes, start=1):
-        backend = default_backend._replace(
-            netloc=f"{default_backend.hostname}:{default_backend.port+i}"
-        )
+    # one backend per existing route, on the ports following the default one
+    host = default_backend.hostname
+    base_port = default_backend.port
+    extra_backends = [
+        default_backend._replace(netloc=f"{host}:{base_port + i}")
+        for i in range(1, len(existing_routes) + 1)
+    ]
+    for backend in extra_backends:
         launch_backend(backend.port, backend.scheme)
-        extra_backends.append(backend)
 
     launch_backend(default_backend.port, default_backend.scheme)
     await wait_for_services(
         [proxy.public_url, default_backend.geturl()]
-        + [backend.geturl() for backend in extra_backends]
+        + [backend.geturl() for backend in extra_backends],
+        http_client,
     )
 
     # Create existing routes
-    for i, spec in enumerate(existing_routes):
-        try:
-            await proxy.add_route(spec, extra_backends[i].geturl(), copy.copy(data))
-        except Exception:
-            pass
+    await asyncio.gather(
+        *(
+            proxy.add_route(spec, extra_backends[i].geturl(), dict(data))
+            for i, spec in enumerate(existing_routes)
+        ),
+        return_exceptions=True,
+    )
 
     def finalizer():
         async def cleanup():
             """ Cleanup """
-            for spec in existing_routes:
-                try:
-                    await proxy.delete_route(spec)
-                except Exception:
-                    pass
+            await asyncio.gather(
+                *(proxy.delete_route(spec) for spec in existing_routes),
+                return_exceptions=True,
+            )
 
         event_loop.run_until_complete(cleanup())
 
@@ -242,12 +270,16 @@ async def test_add_get_delete(
 
     # Test add
     with context(routespec):
-        await proxy.add_route(routespec, default_backend.geturl(), copy.copy(data))
+        await proxy.add_route(routespec, default_backend.geturl(), dict(data))
 
     # Test get
     await test_route_exist(routespec, default_backend)
-    for i, spec in enumerate(existing_routes):
-        await test_route_exist(spec, extra_backends[i])
+    await asyncio.gather(
+        *(
+            test_route_exist(spec, extra_backends[i])
+            for i, spec in enumerate(existing_routes)
+        )
+    )
 
     # Test delete
     with context(routespec):
@@ -255,34 +287,40 @@ async def test_add_get_delete(
         route = await proxy.get_route(routespec)
 
     # Test that deleted route does not exist anymore
-    if not expect_value_error(routespec):
+    if normalized[routespec] is not None:
         assert route == None
 
+        deleted_spec = normalized[routespec]
+        probes = (deleted_spec, f"{deleted_spec}something")
+
         async def _wait_for_deletion():
             deleted = 0
-            for spec in [
-                normalize_spec(routespec),
-                normalize_spec(routespec) + "something",
-            ]:
+            for spec in probes:
                 try:
-                    result = await utils.get_responding_backend_port(proxy_url, spec)
+                    result = await utils.get_responding_backend_port(
+                        proxy_url, spec, http_client
+                    )
                     if result != default_backend.port:
                         deleted += 1
                 except HTTPClientError:
                     deleted += 1
 
-            return deleted == 2
+            return deleted == len(probes)
 
         # If this raises a TimeoutError, the route wasn't properly deleted,
         # thus the proxy still has a route for the given routespec
-        await exponential_backoff(_wait_for_deletion, "Route still exists")
+        await utils.poll_until(_wait_for_deletion, "Route still exists")
 
     # Test that other routes are still exist
-    for i, spec in enumerate(existing_routes):
-        await test_route_exist(spec, extra_backends[i])
+    await asyncio.gather(
+        *(
+            test_route_exist(spec, extra_backends[i])
+            for i, spec in enumerate(existing_routes)
+        )
+    )
 
 
-async def test_get_all_routes(proxy, launch_backend):
+async def test_get_all_routes(proxy, launch_backend, http_client):
     routespecs = ["/proxy/path1", "/proxy/path2/", "/proxy/path3/"]
     targets = [
         "http://127.0.0.1:9900",
@@ -313,37 +351,39 @@ async def test_get_all_routes(proxy, launch_backend):
     for target in targets:
         launch_backend(urlparse(target).port)
 
-    await wait_for_services([proxy.public_url] + targets)
+    await wait_for_services([proxy.public_url] + targets, http_client)
 
-    for routespec, target, data in zip(routespecs, targets, datas):
-        await proxy.add_route(routespec, target, copy.copy(data))
+    await asyncio.gather(
+        *(
+            proxy.add_route(routespec, target, dict(data))
+            for routespec, target, data in zip(routespecs, targets, datas)
+        )
+    )
 
     routes = await proxy.get_all_routes()
-    try:
-        for route_key in routes.keys():
-            del routes[route_key]["data"]["last_activity"]  # CHP
-    except KeyError:
-        pass
+    for route in routes.values():
+        route["data"].pop("last_activity", None)  # CHP
 
     assert routes == expected_output
 
 
-async def test_host_origin_headers(proxy, launch_backend):
+async def test_host_origin_headers(proxy, launch_backend, http_client):
     routespec = "/user/username/"
     target = "http://127.0.0.1:9000"
     data = {}
 
-    traefik_port = urlparse(proxy.public_url).port
-    traefik_host = urlparse(proxy.public_url).hostname
+    public_url = urlparse(proxy.public_url)
+    traefik_port = public_url.port
+    traefik_host = public_url.hostname
     default_backend_port = 9000
     launch_backend(default_backend_port)
 
-    await exponential_backoff(
+    await utils.poll_until(
         utils.check_host_up, "Traefik not reacheable", ip="localhost", port=traefik_port
     )
 
     # Check if default backend is reacheable
-    await exponential_backoff(
+    await utils.poll_until(
         utils.check_host_up,
         "Backends not reacheable",
         ip="localhost",
@@ -352,20 +392,17 @@ async def test_host_origin_headers(proxy, launch_backend):
     # Add route to default_backend
     await proxy.add_route(routespec, target, data)
 
-    if proxy.public_url.endswith("/"):
-        req_url = proxy.public_url[:-1] + routespec
-    else:
-        req_url = proxy.public_url + routespec
+    req_url = f"{proxy.public_url.rstrip('/')}{routespec}"
 
-    expected_host_header = traefik_host + ":" + str(traefik_port)
-    expected_origin_header = proxy.public_url + routespec
+    expected_host_header = f"{traefik_host}:{traefik_port}"
+    expected_origin_header = f"{proxy.public_url}{routespec}"
 
     req = HTTPRequest(
         req_url,
         method="GET",
         headers={"Host": expected_host_header, "Origin": expected_origin_header},
     )
-    resp = await AsyncHTTPClient().fetch(req)
+    resp = await http_client.fetch(req)
 
     assert resp.headers["Host"] == expected_host_header
     assert resp.headers["Origin"] == expected_origin_header
@@ -397,7 +434,6 @@ async def test_check_routes(proxy, username):
     assert test_user.proxy_spec in before
 
     # check if a route is removed when user deleted
-    await proxy.check_routes(users, services)
     await proxy.delete_user(test_user)
     routes = await proxy.get_all_routes()
     during = sorted(routes)
@@ -418,17 +454,17 @@ async def test_websockets(proxy, launch_backend):
     target = "http://127.0.0.1:9000"
     data = {}
 
-    traefik_port = urlparse(proxy.public_url).port
-    traefik_host = urlparse(proxy.public_url).hostname
+    public_url = urlparse(proxy.public_url)
+    traefik_port = public_url.port
     default_backend_port = 9000
     launch_backend(default_backend_port, "ws")
 
-    await exponential_backoff(
+    await utils.poll_until(
         utils.check_host_up, "Traefik not reacheable", ip="localhost", port=traefik_port
     )
 
     # Check if default backend is reacheable
-    await exponential_backoff(
+    await utils.poll_until(
         utils.check_host_up,
         "Backend not reacheable",
         ip="localhost",
@@ -437,13 +473,16 @@ async def test_websockets(proxy, launch_backend):
     # Add route to default_backend
     await proxy.add_route(routespec, target, data)
 
-    public_url = proxy.public_url
-    if proxy.public_url.endswith("/"):
-        public_url = proxy.public_url[:-1]
-
-    req_url = "ws://" + urlparse(proxy.public_url).netloc + routespec
+    req_url = f"ws://{public_url.netloc}{routespec}"
 
-    async with websockets.connect(req_url) as websocket:
+    # The test only reads a few bytes once, so skip compression and keepalive pings
+    async with websockets.connect(
+        req_url,
+        open_timeout=2,
+        ping_interval=None,
+        max_size=2**16,
+        compression=None,
+    ) as websocket:
         port = await websocket.recv()
 
     assert port == str(default_backend_port)
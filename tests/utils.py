@@ -1,9 +1,9 @@
-import socket
+import asyncio
 import json
+import time
 
-from jupyterhub.utils import exponential_backoff
+from jupyterhub.utils import maybe_future
 from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPClientError
-from urllib.parse import urlparse
 
 _ports = {"default_backend": 9000, "first_backend": 9090, "second_backend": 9099}
 
@@ -12,29 +12,45 @@ def get_port(service_name):
     return _ports[service_name]
 
 
-def is_open(ip, port):
-    timeout = 1
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(timeout)
-    try:
-        s.connect((ip, port))
-        s.shutdown(socket.SHUT_RDWR)
-        return True
-    except:
-        return False
-    finally:
-        s.close()
+async def poll_until(fn, fail_message, deadline=10.0, interval=0.025, **kwargs):
+    """Call `fn` every `interval` seconds until it returns a truthy value.
+
+    Unlike exponential_backoff, the wait between checks doesn't grow,
+    so the poll returns as soon as the condition is met.
+    Raise TimeoutError with `fail_message` after `deadline` seconds.
+    """
+    stop = time.monotonic() + deadline
+    while True:
+        result = await maybe_future(fn(**kwargs))
+        if result:
+            return result
+        if time.monotonic() > stop:
+            raise TimeoutError(fail_message)
+        await asyncio.sleep(interval)
 
 
 async def check_host_up(ip, port):
     """Check if the service opened the connection on the
     designated port"""
-    return is_open(ip, port)
+    timeout = 1
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(ip, port), timeout=timeout
+        )
+    except (OSError, asyncio.TimeoutError):
+        return False
 
+    writer.close()
+    await writer.wait_closed()
+    return True
 
-async def get_responding_backend_port(traefik_url, path):
+
+async def get_responding_backend_port(traefik_url, path, http_client=None):
     """Check if traefik followed the configuration and routed the
     request to the right backend"""
+    if http_client is None:
+        http_client = AsyncHTTPClient()
+
     if not path.endswith("/"):
         path += "/"
 
@@ -48,18 +64,32 @@ async def get_responding_backend_port(traefik_url, path):
         req = traefik_url + path
 
     try:
-        resp = await AsyncHTTPClient().fetch(req)
+        resp = await http_client.fetch(req)
         return json.loads(resp.body)
     except HTTPClientError as e:
         raise e
 
 
-async def check_services_ready(urls):
-    ready = True
-    for url in urls:
-        ip = urlparse(url).hostname
-        port = urlparse(url).port
-        status = await check_host_up(ip=ip, port=port)
-        ready = ready and status
+async def check_service_up(url, http_client):
+    """Check if the service answers http requests.
+    Any response, even an error one, means it is up."""
+    try:
+        await http_client.fetch(url, method="HEAD", request_timeout=1)
+    except HTTPClientError as e:
+        # 599 means no response was received (e.g. connection refused)
+        return e.code != 599
+    except OSError:
+        return False
+
+    return True
+
+
+async def check_services_ready(urls, http_client=None):
+    """Check all the services concurrently"""
+    if http_client is None:
+        http_client = AsyncHTTPClient()
 
-    return ready
+    statuses = await asyncio.gather(
+        *(check_service_up(url, http_client) for url in urls)
+    )
+    return all(statuses)